@@ -1,4 +1,7 @@
+import asyncio
 import os
+import time
+from operator import itemgetter
 from typing import List, Dict, Optional
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import ORJSONResponse
@@ -12,6 +15,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 from searchModule import Searcher
+from semantic_cache import SemanticCache
 
 
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
@@ -29,6 +33,14 @@ DEFAULT_RAG_LIMIT = int(os.getenv("DEFAULT_RAG_LIMIT", "5"))
 DEFAULT_CONTEXT_CHARS = int(os.getenv("DEFAULT_CONTEXT_CHARS", "2000"))
 DEFAULT_SCORE_THRESHOLD = float(os.getenv("DEFAULT_SCORE_THRESHOLD", "0.3"))
 
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "300"))
+
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "5"))
+
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", "1"))
+
 
 class SearchRequest(BaseModel):
     query: str
@@ -55,7 +67,22 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
 )
 
+_SEARCH_FIELDS = itemgetter(
+    "id", "final_score", "title", "source", "chunk_index", "text"
+)
+
+_HEALTH_CONFIG = {
+    "default_search_limit": DEFAULT_SEARCH_LIMIT,
+    "default_rag_limit": DEFAULT_RAG_LIMIT,
+    "default_context_chars": DEFAULT_CONTEXT_CHARS,
+    "default_score_threshold": DEFAULT_SCORE_THRESHOLD,
+    "api_key_enabled": API_KEY is not None,
+}
+
 searcher: Optional[Searcher] = None
+semantic_cache: Optional[SemanticCache] = None
+model_ready = False
+_collection_info_cache = {"ts": float("-inf"), "info": None}
 
 
 @app.middleware("http")
@@ -73,7 +100,7 @@ async def api_key_middleware(request: Request, call_next):
 
 @app.on_event("startup")
 def startup_event():
-    global searcher
+    global searcher, semantic_cache, model_ready
 
     logger.info("Запуск API сервиса...")
     logger.info(f"Qdrant: {QDRANT_HOST}:{QDRANT_PORT}")
@@ -94,33 +121,56 @@ def startup_event():
             embedding_model=EMBEDDING_MODEL,
         )
         logger.info("Поисковик инициализирован")
+        searcher.warmup()
+        model_ready = True
+        logger.info("Модель эмбеддингов прогрета")
+        semantic_cache = SemanticCache(
+            max_size=SEMANTIC_CACHE_SIZE,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            ttl=SEMANTIC_CACHE_TTL,
+        )
     except Exception as e:
         logger.error(f"Ошибка инициализации: {e}")
         raise
 
 
+async def _get_collection_info():
+    now = time.monotonic()
+    if now - _collection_info_cache["ts"] < HEALTH_CACHE_TTL:
+        return _collection_info_cache["info"]
+
+    info = await asyncio.to_thread(
+        searcher.client.get_collection, COLLECTION_NAME
+    )
+    _collection_info_cache["info"] = info
+    _collection_info_cache["ts"] = now
+    return info
+
+
+def _collection_distance(info):
+    if info is None:
+        return None
+    distance = getattr(info.config.params.vectors, "distance", None)
+    return distance.value.lower() if distance is not None else None
+
+
 @app.get("/health")
-def health_check():
+async def health_check():
     if searcher is None:
         raise HTTPException(status_code=503, detail="Searcher not initialized")
 
     try:
-        info = searcher.client.get_collection(COLLECTION_NAME)
+        info = await _get_collection_info()
         return {
             "status": "ok",
             "collection": COLLECTION_NAME,
             "points_count": info.points_count,
             "vector_size": 384,
-            "distance": "cosine",
+            "distance": _collection_distance(info),
             "model": EMBEDDING_MODEL,
+            "model_ready": model_ready,
             "query_prefix": "",
-            "config": {
-                "default_search_limit": DEFAULT_SEARCH_LIMIT,
-                "default_rag_limit": DEFAULT_RAG_LIMIT,
-                "default_context_chars": DEFAULT_CONTEXT_CHARS,
-                "default_score_threshold": DEFAULT_SCORE_THRESHOLD,
-                "api_key_enabled": API_KEY is not None,
-            },
+            "config": _HEALTH_CONFIG,
         }
     except Exception:
         return {
@@ -128,21 +178,51 @@ def health_check():
             "collection": COLLECTION_NAME,
             "points_count": None,
             "vector_size": 384,
-            "distance": "cosine",
+            "distance": _collection_distance(_collection_info_cache["info"]),
             "model": EMBEDDING_MODEL,
+            "model_ready": model_ready,
             "query_prefix": "",
-            "config": {
-                "default_search_limit": DEFAULT_SEARCH_LIMIT,
-                "default_rag_limit": DEFAULT_RAG_LIMIT,
-                "default_context_chars": DEFAULT_CONTEXT_CHARS,
-                "default_score_threshold": DEFAULT_SCORE_THRESHOLD,
-                "api_key_enabled": API_KEY is not None,
-            },
+            "config": _HEALTH_CONFIG,
         }
 
 
+def _to_search_payload(result: Dict) -> Dict:
+    id_, score, title, source, chunk_index, text = _SEARCH_FIELDS(result)
+    return {
+        "id": id_,
+        "score": score,
+        "payload": {
+            "title": title,
+            "source": source,
+            "chunk_index": chunk_index,
+            "text": text,
+        },
+    }
+
+
+def _cached_search(query: str, limit: int, score_threshold: float) -> List[Dict]:
+    query_vector = searcher.embed_query(query)
+    cache_key = (limit, score_threshold)
+
+    if semantic_cache is not None:
+        cached = semantic_cache.get(query_vector, cache_key)
+        if cached is not None:
+            return cached
+
+    raw_results = searcher.search(
+        query=query,
+        limit=limit,
+        score_threshold=score_threshold,
+        query_vector=query_vector,
+    )
+
+    if semantic_cache is not None:
+        semantic_cache.put(query_vector, cache_key, raw_results)
+    return raw_results
+
+
 @app.post("/v1/search")
-def search(request: SearchRequest):
+async def search(request: SearchRequest):
     if searcher is None:
         raise HTTPException(status_code=503, detail="Searcher not initialized")
 
@@ -150,25 +230,14 @@ def search(request: SearchRequest):
         raise HTTPException(status_code=400, detail="Query cannot be empty")
 
     try:
-        raw_results = searcher.search(
+        raw_results = await asyncio.to_thread(
+            _cached_search,
             query=request.query,
             limit=request.limit,
             score_threshold=request.score_threshold,
         )
 
-        results = [
-            {
-                "id": r.get("id"),
-                "score": r.get("final_score"),
-                "payload": {
-                    "title": r.get("title", ""),
-                    "source": r.get("source", ""),
-                    "chunk_index": r.get("chunk_index", 0),
-                    "text": r.get("text", ""),
-                },
-            }
-            for r in raw_results
-        ]
+        results = list(map(_to_search_payload, raw_results))
 
         return {
             "query": request.query,
@@ -182,7 +251,7 @@ def search(request: SearchRequest):
 
 
 @app.get("/v1/rag")
-def rag(
+async def rag(
     q: str,
     limit: int = DEFAULT_RAG_LIMIT,
     context_chars: int = DEFAULT_CONTEXT_CHARS,
@@ -195,7 +264,7 @@ def rag(
         raise HTTPException(status_code=400, detail="Query 'q' cannot be empty")
 
     try:
-        raw_results = searcher.search(query=q, limit=limit)
+        raw_results = await asyncio.to_thread(searcher.search, query=q, limit=limit)
 
         chunks = []
         context_parts = []
@@ -206,16 +275,19 @@ def rag(
             source = result.get("source", "")
             text = result.get("text", "")
             chunk_index = result.get("chunk_index", 0)
+            text_len = len(text)
 
-            if context_chars and used + len(text) > context_chars:
+            if context_chars and used + text_len > context_chars:
                 remaining = context_chars - used
                 if remaining > 100:
                     text = text[:remaining] + "..."
+                    text_len = remaining + 3
                 else:
                     break
 
-            header = f"[{i}] {title} ({source}, chunk {chunk_index})"
-            context_parts.append(header + "\n" + text)
+            context_parts.append(
+                f"[{i}] {title} ({source}, chunk {chunk_index})\n{text}"
+            )
 
             chunks.append(
                 {
@@ -229,7 +301,7 @@ def rag(
                 }
             )
 
-            used += len(text)
+            used += text_len
             if context_chars and used >= context_chars:
                 break
 
@@ -248,7 +320,7 @@ def rag(
 
 
 @app.get("/")
-def root():
+async def root():
     return {
         "name": "RAG Search API",
         "version": "2.0.0",
@@ -266,4 +338,10 @@ def root():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8080, log_level="info")
+    uvicorn.run(
+        "apiModule:app",
+        host="0.0.0.0",
+        port=8080,
+        workers=UVICORN_WORKERS,
+        log_level="info",
+    )
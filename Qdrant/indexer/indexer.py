@@ -1,14 +1,25 @@
 import os
 import time
-import pickle
+import joblib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
 from tqdm import tqdm
-from rank_bm25 import BM25Okapi
+import bm25s
 import re
 
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client.http.models import (
+    Batch,
+    Distance,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
 from fastembed import TextEmbedding
 
 from latex_chunker import LaTeXChunker
@@ -16,6 +27,29 @@ from latex_chunker import LaTeXChunker
 import logging
 logger = logging.getLogger(__name__)
 
+UPSERT_BATCH_SIZE = 256
+UPSERT_QUEUE_SIZE = 4
+
+_WORD_RE = re.compile(r"\w+")
+
+
+_worker_chunker: Optional[LaTeXChunker] = None
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _init_chunk_worker(chunker_kwargs: Dict):
+    global _worker_chunker
+    _worker_chunker = LaTeXChunker(**chunker_kwargs)
+
+
+def _chunk_one(filepath: Path) -> List[Dict]:
+    return _worker_chunker.chunk_document(filepath)
+
 
 class SimpleIndexer:
 
@@ -23,20 +57,36 @@ class SimpleIndexer:
             self,
             qdrant_host: str = "localhost",
             qdrant_port: int = 6333,
+            qdrant_grpc_port: int = 6334,
             collection_name: str = "latex_books",
             embedding_model: str = "sentence-transformers"
                                    "/paraphrase-multilingual-mpnet-base-v2",
             bm25_index_path: str = "/app/data/bm25_index.pkl",
+            embed_batch_size: int = 256,
+            embed_parallel: Optional[int] = None,
+            chunk_workers: Optional[int] = None,
+            upsert_workers: int = 2,
+            upsert_batch_size: int = UPSERT_BATCH_SIZE,
     ):
         self.qdrant_host = qdrant_host
         self.qdrant_port = qdrant_port
         self.collection_name = collection_name
         self.bm25_index_path = bm25_index_path
+        self.embed_batch_size = embed_batch_size
+        self.embed_parallel = embed_parallel
+        self.chunk_workers = chunk_workers
+        self.upsert_workers = max(upsert_workers, 1)
+        self.upsert_batch_size = max(upsert_batch_size, 1)
+
+        self.client = QdrantClient(
+            host=qdrant_host,
+            port=qdrant_port,
+            grpc_port=qdrant_grpc_port,
+            prefer_grpc=True,
+        )
 
-        self.client = QdrantClient(host=qdrant_host, port=qdrant_port)
-
-        logger.info(f"Загружаем модель: {embedding_model}")
-        self.embedding_model = TextEmbedding(embedding_model)
+        self.embedding_model_name = embedding_model
+        self._embedding_model = None
 
         self.vector_size = 768
         logger.info(f"Размерность векторов: {self.vector_size}")
@@ -46,11 +96,96 @@ class SimpleIndexer:
         self.bm25 = None
         self.corpus = []
 
+    @property
+    def embedding_model(self) -> TextEmbedding:
+        if self._embedding_model is None:
+            logger.info(f"Загружаем модель: {self.embedding_model_name}")
+            if self.embed_parallel is None:
+                self._embedding_model = TextEmbedding(self.embedding_model_name)
+            else:
+                self._embedding_model = TextEmbedding(
+                    self.embedding_model_name, threads=1, lazy_load=True
+                )
+        return self._embedding_model
+
     def _tokenize_russian(self, text: str):
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', ' ', text)
-        tokens = text.split()
-        return tokens
+        return _WORD_RE.findall(text.lower())
+
+    def _iter_embeddings(
+            self, texts: List[str]
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        # Identical chunks (repeated boilerplate, duplicated files) are embedded once.
+        positions: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            positions.setdefault(text, []).append(i)
+
+        unique_texts = sorted(positions, key=len)
+        embeddings = self.embedding_model.embed(
+            unique_texts,
+            batch_size=self.embed_batch_size,
+            parallel=self.embed_parallel,
+        )
+        for text, embedding in zip(unique_texts, embeddings):
+            for i in positions[text]:
+                yield i, embedding
+
+    @staticmethod
+    def _chunk_payload(chunk: Dict) -> Dict:
+        return {
+            "text": chunk["text"],
+            "title": chunk["title"],
+            "source": chunk["source"],
+            "chunk_index": chunk["chunk_index"],
+            "section": chunk["section"],
+        }
+
+    def _iter_batches(self, chunks: List[Dict], texts: List[str]) -> Iterator[Batch]:
+        for batch in _batched(self._iter_embeddings(texts), self.upsert_batch_size):
+            ids = [point_id for point_id, _ in batch]
+            vectors = np.stack([vector for _, vector in batch]).astype(
+                np.float32, copy=False
+            )
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            yield Batch(
+                ids=ids,
+                vectors=vectors.tolist(),
+                payloads=[self._chunk_payload(chunks[i]) for i in ids],
+            )
+
+    def _upload_points(self, chunks: List[Dict], texts: List[str]):
+        pending = deque()
+        last_batch = None
+        max_pending = max(UPSERT_QUEUE_SIZE, self.upsert_workers)
+
+        with ThreadPoolExecutor(max_workers=self.upsert_workers) as executor:
+            for batch in tqdm(
+                    self._iter_batches(chunks, texts),
+                    total=-(-len(chunks) // self.upsert_batch_size),
+                    desc="Загрузка в Qdrant",
+            ):
+                if last_batch is not None:
+                    pending.append(executor.submit(
+                        self.client.upsert,
+                        collection_name=self.collection_name,
+                        points=last_batch,
+                        wait=False,
+                    ))
+                    if len(pending) > max_pending:
+                        pending.popleft().result()
+                last_batch = batch
+
+            for future in pending:
+                future.result()
+
+        # Concurrent requests may arrive out of order, so the final batch is
+        # sent only after the others are acknowledged; waiting on it then
+        # guarantees every earlier write is applied on return.
+        if last_batch is not None:
+            self.client.upsert(
+                collection_name=self.collection_name,
+                points=last_batch,
+                wait=True,
+            )
 
     def wait_for_qdrant(self, timeout: int = 120):
         logger.info(f"Ожидание Qdrant на {self.qdrant_host}:{self.qdrant_port}...")
@@ -82,19 +217,48 @@ class SimpleIndexer:
         self.client.create_collection(
             collection_name=self.collection_name,
             vectors_config=VectorParams(
-                size=self.vector_size, distance=Distance.COSINE
+                size=self.vector_size, distance=Distance.DOT
+            ),
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8, always_ram=True
+                )
             ),
         )
         logger.info(f"Коллекция {self.collection_name} создана")
 
+    def _chunk_files(self, tex_files: List[Path]) -> List[Dict]:
+        chunker_kwargs = {
+            "chunk_size": self.chunker.chunk_size,
+            "overlap": self.chunker.overlap,
+            "min_chunk_size": self.chunker.min_chunk_size,
+            "cache_dir": self.chunker.cache_dir,
+        }
+        chunks = []
+
+        with ProcessPoolExecutor(
+                max_workers=self.chunk_workers or os.cpu_count(),
+                initializer=_init_chunk_worker,
+                initargs=(chunker_kwargs,),
+        ) as executor:
+            futures = [executor.submit(_chunk_one, path) for path in tex_files]
+            for filepath, future in tqdm(
+                    zip(tex_files, futures),
+                    total=len(tex_files),
+                    desc="Обработка файлов",
+            ):
+                try:
+                    chunks.extend(future.result())
+                except Exception as e:
+                    logger.error(f"\n Ошибка обработки {filepath.name}: {e}")
+
+        return chunks
+
     def index_directory(self, directory: Path, max_files: int | None = None):
         if not directory.exists():
             raise FileNotFoundError(f"Директория не найдена: {directory}")
 
-        tex_files = list(directory.glob("*.tex"))
-
-        if max_files:
-            tex_files = tex_files[:max_files]
+        tex_files = list(islice(directory.glob("*.tex"), max_files or None))
 
         logger.info(f"Найдено {len(tex_files)} LaTeX файлов")
 
@@ -102,72 +266,64 @@ class SimpleIndexer:
             logger.error("Нет файлов для индексации")
             return
 
-        all_points = []
-        point_id = 0
-        tokenized_corpus = []
+        chunks = self._chunk_files(tex_files)
 
-        for filepath in tqdm(tex_files, desc="Обработка файлов"):
-            try:
-                chunks = self.chunker.chunk_document(filepath)
-
-                texts = [chunk["text"] for chunk in chunks]
-                embeddings = list(self.embedding_model.embed(texts))
-
-                for chunk, embedding in zip(chunks, embeddings):
-                    point = PointStruct(
-                        id=point_id,
-                        vector=list(embedding),
-                        payload={
-                            "text": chunk["text"],
-                            "title": chunk["title"],
-                            "source": chunk["source"],
-                            "chunk_index": chunk["chunk_index"],
-                            "section": chunk["section"],
-                        },
-                    )
-                    all_points.append(point)
-
-                    self.corpus.append(chunk["text"])
-                    tokenized_corpus.append(
-                        self._tokenize_russian(chunk["text"])
-                    )
-
-                    point_id += 1
-
-            except Exception as e:
-                logger.error(f"\n Ошибка обработки {filepath.name}: {e}")
-                continue
-
-        batch_size = 100
-        logger.info(f"\nЗагрузка {len(all_points)} чанков в Qdrant...")
-
-        for i in tqdm(range(0, len(all_points), batch_size), desc="Загрузка в Qdrant"):
-            batch = all_points[i: i + batch_size]
-            self.client.upsert(
-                collection_name=self.collection_name, points=batch, wait=True
-            )
+        texts = [chunk["text"] for chunk in chunks]
+        self.corpus.extend(texts)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            bm25_future = executor.submit(self._build_bm25, texts)
 
-        logger.info(f"\n Загружено {len(all_points)} чанков из {len(tex_files)} файлов")
+            logger.info(f"\nЭмбеддинги и загрузка {len(chunks)} чанков в Qdrant...")
+            self._upload_points(chunks, texts)
+            logger.info(
+                f"\n Загружено {len(chunks)} чанков из {len(tex_files)} файлов"
+            )
 
-        logger.info(f"\nИндексируем {len(tokenized_corpus)} документов в BM25...")
-        self.bm25 = BM25Okapi(tokenized_corpus)
+            self.bm25 = bm25_future.result()
 
         logger.info(f"Сохраняем BM25 индекс в {self.bm25_index_path}...")
-        with open(self.bm25_index_path, "wb") as f:
-            pickle.dump({
+        corpus_offsets, corpus_data = self._pack_corpus(self.corpus)
+        tmp_path = f"{self.bm25_index_path}.{os.getpid()}"
+        joblib.dump(
+            {
                 "bm25": self.bm25,
-                "corpus": self.corpus,
-            }, f)
+                "corpus_offsets": corpus_offsets,
+                "corpus_data": corpus_data,
+            },
+            tmp_path,
+            protocol=5,
+        )
+        # A running API memory-maps the index; replacing the file instead of
+        # rewriting it in place leaves its mapping on the old inode intact.
+        os.replace(tmp_path, self.bm25_index_path)
         logger.info("BM25 индекс сохранён")
 
+    def _build_bm25(self, texts: List[str]) -> bm25s.BM25:
+        logger.info(f"\nИндексируем {len(texts)} документов в BM25...")
+        tokenized_corpus = [self._tokenize_russian(text) for text in texts]
+        bm25 = bm25s.BM25()
+        bm25.index(tokenized_corpus, show_progress=False)
+        return bm25
+
+    @staticmethod
+    def _pack_corpus(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return offsets, data
+
     def load_bm25_index(self):
         if os.path.exists(self.bm25_index_path):
             logger.info(f"Загружаем BM25 индекс из {self.bm25_index_path}...")
-            with open(self.bm25_index_path, "rb") as f:
-                data = pickle.load(f)
-                self.bm25 = data["bm25"]
-                self.corpus = data["corpus"]
-            logger.info(f"BM25 индекс загружен ({len(self.corpus)} документов)")
+            data = joblib.load(self.bm25_index_path, mmap_mode="r")
+            self.bm25 = data["bm25"]
+            self.corpus_offsets = data["corpus_offsets"]
+            self.corpus_data = data["corpus_data"]
+            logger.info(
+                f"BM25 индекс загружен ({len(self.corpus_offsets) - 1} документов)"
+            )
             return True
         else:
             logger.error(f"BM25 индекс не найден по пути {self.bm25_index_path}")
@@ -208,6 +364,12 @@ def main():
         default=int(os.getenv("QDRANT_PORT", "6333")),
         help="Порт Qdrant",
     )
+    parser.add_argument(
+        "--grpc-port",
+        type=int,
+        default=int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+        help="gRPC порт Qdrant",
+    )
     parser.add_argument(
         "--collection", type=str, default="latex_books", help="Название коллекции"
     )
@@ -230,15 +392,51 @@ def main():
         default="./bm25_index.pkl",
         help="Путь к BM25 индексу",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Размер батча для вычисления embeddings",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=None,
+        help="Число процессов для вычисления embeddings (0 — все ядра)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Число процессов для чанкинга LaTeX файлов (по умолчанию — все ядра)",
+    )
+    parser.add_argument(
+        "--upsert-workers",
+        type=int,
+        default=2,
+        help="Число параллельных запросов загрузки в Qdrant",
+    )
+    parser.add_argument(
+        "--upsert-batch-size",
+        type=int,
+        default=UPSERT_BATCH_SIZE,
+        help="Число точек в одном запросе загрузки в Qdrant",
+    )
 
     args = parser.parse_args()
 
     indexer = SimpleIndexer(
         qdrant_host=args.host,
         qdrant_port=args.port,
+        qdrant_grpc_port=args.grpc_port,
         collection_name=args.collection,
         embedding_model=args.model,
         bm25_index_path=args.bm25_index,
+        embed_batch_size=args.batch_size,
+        embed_parallel=args.parallel,
+        chunk_workers=args.workers,
+        upsert_workers=args.upsert_workers,
+        upsert_batch_size=args.upsert_batch_size,
     )
 
     indexer.wait_for_qdrant()
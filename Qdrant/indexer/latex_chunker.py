@@ -1,9 +1,19 @@
+import gzip
+import hashlib
 import os
 import re
+import zlib
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
+from pylatexenc import __version__ as PYLATEXENC_VERSION
 from pylatexenc.latex2text import LatexNodes2Text
 
+# Anything pylatexenc would rewrite; text without these converts to itself.
+_LATEX_SYNTAX_RE = re.compile(r"[\\$%{}~&^_#]|--|``|''|[!?]`")
+
+_TITLE_RE = re.compile(r"==\s*([^=]+?)\s*==")
+_SECTION_SPLIT_RE = re.compile(r"={2,}\s*([^=]+?)\s*={2,}")
+
 
 class LaTeXChunker:
 
@@ -12,10 +22,12 @@ class LaTeXChunker:
         chunk_size: int | None = None,
         overlap: int | None = None,
         min_chunk_size: int | None = None,
+        cache_dir: str | None = None,
     ):
         self.chunk_size = chunk_size or int(os.getenv("CHUNK_MAX_LEN", "2000"))
         self.overlap = overlap or int(os.getenv("CHUNK_OVERLAP", "300"))
         self.min_chunk_size = min_chunk_size or int(os.getenv("CHUNK_MIN_LEN", "1500"))
+        self.cache_dir = cache_dir or os.getenv("LATEX_CACHE_DIR") or None
         self.converter = LatexNodes2Text()
         print(
             f"Chunker init: chunk_size={self.chunk_size},"
@@ -24,30 +36,66 @@ class LaTeXChunker:
         )
 
     def read_latex_file(self, filepath: Path) -> tuple[str, str, str]:
+        data = filepath.read_bytes()
         raw_latex = ""
         for encoding in ["utf-8", "cp1251", "koi8-r"]:
             try:
-                raw_latex = filepath.read_text(encoding=encoding)
+                raw_latex = data.decode(encoding)
+                if "\r" in raw_latex:
+                    # Match the universal-newline translation of text-mode reads.
+                    raw_latex = raw_latex.replace("\r\n", "\n").replace("\r", "\n")
                 break
             except UnicodeDecodeError:
                 continue
 
         if not raw_latex:
-            raw_latex = filepath.read_bytes().decode("utf-8", errors="ignore")
+            raw_latex = data.decode("utf-8", errors="ignore")
 
         try:
-            plain_text = self.converter.latex_to_text(raw_latex)
+            plain_text = self._convert_latex(raw_latex)
         except Exception:
             plain_text = raw_latex
 
         title = self._extract_title_from_filename(filepath.name)
 
-        title_match = re.search(r"==\s*([^=]+?)\s*==", plain_text)
+        title_match = _TITLE_RE.search(plain_text)
         if title_match:
             title = title_match.group(1).strip()
 
         return raw_latex, plain_text, title
 
+    def _cache_path(self, raw_latex: str) -> Optional[Path]:
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha256(
+            f"{PYLATEXENC_VERSION}\0{raw_latex}".encode("utf-8")
+        ).hexdigest()
+        return Path(self.cache_dir) / digest[:2] / f"{digest}.txt.gz"
+
+    def _convert_latex(self, raw_latex: str) -> str:
+        if not _LATEX_SYNTAX_RE.search(raw_latex):
+            return raw_latex
+
+        cache_path = self._cache_path(raw_latex)
+        if cache_path is not None:
+            try:
+                return gzip.decompress(cache_path.read_bytes()).decode("utf-8")
+            except (OSError, EOFError, UnicodeDecodeError, zlib.error):
+                pass
+
+        plain_text = self.converter.latex_to_text(raw_latex)
+
+        if cache_path is not None:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+                tmp_path.write_bytes(gzip.compress(plain_text.encode("utf-8"), 1))
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+        return plain_text
+
     def _extract_title_from_filename(self, filename: str) -> str:
         name = filename.replace(".tex", "")
         name = name.replace("Просмотр_исходного_текста_страницы_", "")
@@ -58,27 +106,25 @@ class LaTeXChunker:
         raw_latex, plain_text, title = self.read_latex_file(filepath)
 
         sections = self._extract_sections(plain_text)
+        file_title = self._extract_title_from_filename(filepath.name)
 
         chunks = []
         chunk_id = 0
 
         for section in sections:
             section_chunks = self._split_section(section, title, filepath.name)
+            # Every chunk starts with the same "<prefix>\n\n" header.
+            body_start = len(self._format_prefix(filepath.name, section["title"])) + 2
 
             for chunk_text in section_chunks:
-                text_without_prefix = (
-                    chunk_text.split("\n\n", 1)[-1]
-                    if "\n\n" in chunk_text
-                    else chunk_text
-                )
-                if len(text_without_prefix.strip()) < self.min_chunk_size:
+                if len(chunk_text[body_start:].strip()) < self.min_chunk_size:
                     continue
                 chunks.append(
                     {
                         "id": chunk_id,
                         "text": chunk_text,
-                        "title": self._extract_title_from_filename(filepath.name),
-                        "source": self._extract_title_from_filename(filepath.name),
+                        "title": file_title,
+                        "source": file_title,
                         "chunk_index": chunk_id,
                         "section": section.get("title", ""),
                     }
@@ -90,7 +136,7 @@ class LaTeXChunker:
     def _extract_sections(self, text: str) -> List[Dict]:
         sections = []
 
-        parts = re.split(r"={2,}\s*([^=]+?)\s*={2,}", text)
+        parts = _SECTION_SPLIT_RE.split(text)
 
         if len(parts) == 1:
             sections.append({"title": "", "content": text.strip()})
@@ -109,8 +155,6 @@ class LaTeXChunker:
 
         return sections
 
-    from typing import Dict, List
-
     def _format_prefix(self, source: str, section_title: str) -> str:
         prefix = source
         if section_title:
@@ -118,43 +162,18 @@ class LaTeXChunker:
         return prefix
 
     def _chunk_large_paragraph(self, para: str, prefix: str) -> List[str]:
-        chunks = []
-        for i in range(0, len(para), self.chunk_size - self.overlap):
-            chunk_text = para[i: i + self.chunk_size]
-            chunks.append(f"{prefix}\n\n{chunk_text}")
-        return chunks
+        head = f"{prefix}\n\n"
+        size = self.chunk_size
+        return [
+            head + para[i: i + size]
+            for i in range(0, len(para), size - self.overlap)
+        ]
 
     def _flush_current_chunk(
         self, chunks: List[str], current_chunk: List[str], prefix: str
     ):
         if current_chunk:
-            chunks.append(f"{prefix}\n\n" + "\n\n".join(current_chunk))
-
-    def _process_small_paragraph(
-        self,
-        para: str,
-        current_chunk: List[str],
-        current_size: int,
-        chunks: List[str],
-        prefix: str,
-    ) -> (List[str], int):
-        para_size = len(para)
-
-        if current_size + para_size + 2 > self.chunk_size and current_chunk:
-            self._flush_current_chunk(chunks, current_chunk, prefix)
-
-            if len(current_chunk) > 0:
-                new_chunk = [current_chunk[-1], para]
-                new_size = len(current_chunk[-1]) + para_size + 2
-            else:
-                new_chunk = [para]
-                new_size = para_size
-
-            return new_chunk, new_size
-
-        current_chunk.append(para)
-        current_size += para_size + 2
-        return current_chunk, current_size
+            chunks.append("\n\n".join([prefix, *current_chunk]))
 
     def _split_section(self, section: Dict, title: str, source: str) -> List[str]:
         content = section["content"]
@@ -170,6 +189,7 @@ class LaTeXChunker:
         chunks: List[str] = []
         current_chunk: List[str] = []
         current_size = 0
+        last_size = 0
 
         for para in paragraphs:
             para = para.strip()
@@ -187,9 +207,14 @@ class LaTeXChunker:
                 chunks.extend(large_parts)
                 continue
 
-            current_chunk, current_size = self._process_small_paragraph(
-                para, current_chunk, current_size, chunks, prefix
-            )
+            if current_chunk and current_size + para_size + 2 > self.chunk_size:
+                self._flush_current_chunk(chunks, current_chunk, prefix)
+                current_chunk = [current_chunk[-1], para]
+                current_size = last_size + para_size + 2
+            else:
+                current_chunk.append(para)
+                current_size += para_size + 2
+            last_size = para_size
 
         self._flush_current_chunk(chunks, current_chunk, prefix)
 
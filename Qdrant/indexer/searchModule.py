@@ -1,7 +1,12 @@
+import heapq
 import os
 import re
-import pickle
-from typing import List, Dict, Set
+import joblib
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
+from typing import List, Dict, FrozenSet, Set, Tuple
+import numpy as np
 from qdrant_client import QdrantClient
 from fastembed import TextEmbedding
 from qdrant_client import models
@@ -9,6 +14,56 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+QUERY_EMBED_CACHE = int(os.getenv("QUERY_EMBED_CACHE", "4096"))
+
+_WORD_RE = re.compile(r"\w+")
+
+_QUESTION_PREFIX_RE = re.compile(
+    r"^(что такое|как|где|когда|почему|какой|какая|какие)\s+"
+)
+
+_QUERY_STOPWORDS = frozenset(
+    {
+        "что",
+        "такое",
+        "это",
+        "как",
+        "где",
+        "когда",
+        "почему",
+        "какой",
+        "какая",
+        "какие",
+        "является",
+    }
+)
+
+
+_REFERENCE_SECTIONS = frozenset(
+    {
+        "см. также",
+        "см также",
+        "источники информации",
+        "источники",
+        "литература",
+    }
+)
+
+_CONTENT_MARKERS = (
+    "определение", "теорема", "лемма",
+    "доказательство", "утверждение", "алгоритм",
+)
+
+
+@dataclass(frozen=True, slots=True)
+class QueryContext:
+    query_words: FrozenSet[str]
+    title_query: str
+    clean_query: str
+    bigrams: FrozenSet[str]
+    trigrams: FrozenSet[str]
+    keyword_words: FrozenSet[str]
+
 
 class Searcher:
     def __init__(
@@ -20,37 +75,81 @@ class Searcher:
                                "/paraphrase-multilingual-mpnet-base-v2",
         bm25_index_path: str = "/app/data/bm25_index.pkl",
         alpha: float = 0.6,
+        query_cache_size: int = QUERY_EMBED_CACHE,
+        exact_search: bool = False,
     ):
         self.qdrant_host = qdrant_host
         self.qdrant_port = qdrant_port
         self.collection_name = collection_name
         self.bm25_index_path = bm25_index_path
         self.alpha = alpha
+        self.exact_search = exact_search
 
         self.client = QdrantClient(host=qdrant_host, port=qdrant_port)
         self.embedding_model = TextEmbedding(embedding_model)
+        self._embed_cached = lru_cache(maxsize=query_cache_size)(self._embed_uncached)
         self.bm25 = None
-        self.corpus = []
+        self.corpus_offsets = None
+        self.corpus_data = None
         self._load_bm25()
 
     def _load_bm25(self):
         if os.path.exists(self.bm25_index_path):
             logger.info(f"Загружаем BM25 индекс из {self.bm25_index_path}...")
-            with open(self.bm25_index_path, "rb") as f:
-                data = pickle.load(f)
-                self.bm25 = data["bm25"]
-                self.corpus = data["corpus"]
-            logger.info(f"BM25 индекс загружен ({len(self.corpus)} документов)")
+            try:
+                data = joblib.load(self.bm25_index_path, mmap_mode="r")
+                bm25 = data["bm25"]
+                corpus_offsets = data["corpus_offsets"]
+                corpus_data = data["corpus_data"]
+            except Exception as e:
+                logger.error(
+                    f"Не удалось загрузить BM25 индекс ({e!r}), переиндексируйте "
+                    "данные. Поиск будет работать только через Qdrant."
+                )
+                return
+            self.bm25 = bm25
+            self.corpus_offsets = corpus_offsets
+            self.corpus_data = corpus_data
+            logger.info(f"BM25 индекс загружен ({self.corpus_size} документов)")
         else:
             logger.info(
                 "BM25 индекс не найден. Поиск будет работать только через Qdrant."
             )
 
+    @property
+    def corpus_size(self) -> int:
+        if self.corpus_offsets is None:
+            return 0
+        return len(self.corpus_offsets) - 1
+
+    def corpus_get(self, doc_id: int) -> str:
+        start, end = self.corpus_offsets[doc_id], self.corpus_offsets[doc_id + 1]
+        return self.corpus_data[start:end].tobytes().decode("utf-8")
+
+    def _embed_uncached(self, query: str):
+        vector = np.asarray(
+            next(iter(self.embedding_model.embed([query]))), dtype=np.float32
+        )
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        vector.setflags(write=False)
+        return vector
+
+    def warmup(self):
+        self._embed_uncached("warmup")
+
+    def embed_query(self, query: str):
+        return self._embed_cached(query.strip())
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        vectors = np.stack([
+            np.asarray(vector, dtype=np.float32)
+            for vector in self.embedding_model.embed([q.strip() for q in queries])
+        ])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+        return vectors
+
     def _tokenize_russian(self, text: str):
-        text = text.lower()
-        text = re.sub(r"[^\w\s]", " ", text)
-        tokens = text.split()
-        return tokens
+        return _WORD_RE.findall(text.lower())
 
     def get_collection_info(self) -> Dict:
         try:
@@ -65,9 +164,16 @@ class Searcher:
             return {"error": str(e)}
 
     def count_word_hits(self, text, query_words):
-        words = set(re.findall(r"\b\w+\b", text.lower()))
+        words = set(_WORD_RE.findall(text.lower()))
         return len(words & query_words)
 
+    def _has_word_hit(self, text_lower, query_words) -> bool:
+        if not query_words:
+            return False
+        return any(
+            match.group() in query_words for match in _WORD_RE.finditer(text_lower)
+        )
+
     def get_titles(self) -> List[str]:
         res = self.client.scroll(collection_name=self.collection_name, limit=10000)
         return list({point.payload.get("title", "") for point in res})
@@ -78,23 +184,96 @@ class Searcher:
         return text
 
     def search(
-            self, query: str, limit: int = 10, score_threshold: float = 0.0
+            self,
+            query: str,
+            limit: int = 10,
+            score_threshold: float = 0.0,
+            query_vector=None,
     ) -> List[Dict]:
-        query_vector = list(self.embedding_model.embed([query]))[0]
+        if query_vector is None:
+            query_vector = self.embed_query(query)
         search_limit = limit * 10
 
         vector_results = self._search_vectors(query_vector, score_threshold, search_limit)
-        bm25_map = self._compute_bm25_map(query)
+        return self._rerank(query, vector_results, limit)
+
+    def search_batch(
+            self,
+            queries: List[str],
+            limit: int = 10,
+            score_threshold: float = 0.0,
+    ) -> List[List[Dict]]:
+        if not queries:
+            return []
+
+        query_vectors = self.embed_queries(queries)
+        batch_results = self.client.search_batch(
+            collection_name=self.collection_name,
+            requests=[
+                models.SearchRequest(
+                    vector=vector.tolist(),
+                    limit=limit * 10,
+                    score_threshold=score_threshold,
+                    params=self._search_params(),
+                    with_payload=True,
+                )
+                for vector in query_vectors
+            ],
+        )
+        return [
+            self._rerank(query, vector_results, limit)
+            for query, vector_results in zip(queries, batch_results)
+        ]
 
-        enriched_results = self._enrich_results(query, vector_results, bm25_map)
+    def _rerank(self, query: str, vector_results, limit: int) -> List[Dict]:
+        if not vector_results:
+            return []
 
-        for r in enriched_results:
-            if self.count_word_hits(r["text"],
-                                    set(re.findall(r"\b\w+\b", query.lower()))) == 0:
-                r["final_score"] *= 0.2
+        bm25_scores = self._compute_bm25_scores(
+            query, [result.id for result in vector_results]
+        )
+        vector_scores = np.fromiter(
+            (result.score for result in vector_results),
+            dtype=np.float64,
+            count=len(vector_results),
+        )
+        hybrid_scores = self.alpha * vector_scores + (1 - self.alpha) * bm25_scores
+
+        query_ctx = self._prepare_query_context(query)
+        features = np.array(
+            [
+                self._candidate_features(result.payload, query_ctx)
+                for result in vector_results
+            ],
+            dtype=np.float64,
+        )
+        final_scores = self._apply_scoring_rules(hybrid_scores, features).tolist()
 
-        enriched_results.sort(key=lambda x: x["final_score"], reverse=True)
-        return enriched_results[:limit]
+        bm25_scores = bm25_scores.tolist()
+        hybrid_scores = hybrid_scores.tolist()
+        keyword_scores = features[:, 0].tolist()
+
+        top = heapq.nlargest(
+            limit, range(len(final_scores)), key=final_scores.__getitem__
+        )
+        return [
+            self._build_result(
+                vector_results[i],
+                bm25_scores[i],
+                keyword_scores[i],
+                hybrid_scores[i],
+                final_scores[i],
+            )
+            for i in top
+        ]
+
+    def _search_params(self) -> models.SearchParams:
+        return models.SearchParams(
+            exact=self.exact_search,
+            quantization=models.QuantizationSearchParams(
+                rescore=True, oversampling=2.0
+            ),
+        )
 
     def _search_vectors(self, query_vector, score_threshold, search_limit):
         return self.client.search(
@@ -102,247 +281,234 @@ class Searcher:
             query_vector=query_vector,
             limit=search_limit,
             score_threshold=score_threshold,
-            search_params=models.SearchParams(exact=True),
+            search_params=self._search_params(),
         )
 
-    def _compute_bm25_map(self, query: str) -> Dict[str, float]:
-        bm25_map = {}
-        if not self.bm25:
-            return bm25_map
+    def _compute_bm25_scores(self, query: str, point_ids: List) -> np.ndarray:
+        bm25_scores = np.zeros(len(point_ids), dtype=np.float64)
+        if not self.bm25 or not point_ids:
+            return bm25_scores
 
         tokenized_query = self._tokenize_russian(query)
-        scores = self.bm25.get_scores(tokenized_query)
-        max_score = max(scores)
-
-        if max_score > 0:
-            scores = [s / max_score for s in scores]
+        if not tokenized_query:
+            return bm25_scores
 
-        return {str(doc_id): score for doc_id, score in enumerate(scores)}
-
-    def _enrich_results(self, query: str, vector_results, bm25_map):
-        enriched = []
-        query_words = set(re.findall(r"\b\w+\b", query.lower()))
-
-        for result in vector_results:
-            enriched.append(self._enrich_single_result(
-                result,
-                query,
-                query_words,
-                bm25_map))
+        scores = self.bm25.get_scores(tokenized_query)
+        max_score = float(scores.max())
+        if max_score <= 0:
+            max_score = 1.0
+
+        doc_ids = np.fromiter(
+            (
+                point_id
+                if isinstance(point_id, int) and 0 <= point_id < len(scores)
+                else -1
+                for point_id in point_ids
+            ),
+            dtype=np.int64,
+            count=len(point_ids),
+        )
+        known = doc_ids >= 0
+        bm25_scores[known] = scores[doc_ids[known]].astype(np.float64) / max_score
+        return bm25_scores
 
-        return enriched
+    def _prepare_query_context(self, query: str) -> QueryContext:
+        query_lower = self._normalize_text(query)
+        clean_query = self._clean_query(query_lower)
+        query_for_ngrams = clean_query if clean_query else query_lower
+        return QueryContext(
+            query_words=frozenset(_WORD_RE.findall(query.lower())),
+            title_query=query.lower().replace(" ", "_"),
+            clean_query=clean_query,
+            bigrams=frozenset(self._extract_ngrams(query_for_ngrams, 2)),
+            trigrams=frozenset(self._extract_ngrams(query_for_ngrams, 3)),
+            keyword_words=frozenset(self._filter_query_words(query_lower)),
+        )
 
-    def _enrich_single_result(self, result, query, query_words, bm25_map):
-        payload = result.payload
+    def _candidate_features(self, payload: Dict, query_ctx: QueryContext) -> Tuple:
         text = payload.get("text", "")
-        title = payload.get("title", "").lower()
+        title = payload.get("title", "")
         section = payload.get("section", "")
-
-        vector_score = result.score
-        bm25_score = bm25_map.get(str(result.id), 0.0)
-        hybrid_score = self.alpha * vector_score + (1 - self.alpha) * bm25_score
-
-        keyword_score = self._compute_keyword_score(query, payload)
-        final_score = self._apply_scoring_rules(
-            hybrid_score,
-            keyword_score,
-            query_words,
-            title,
-            section,
-            text,
-            query,
+        text_lower = text.lower()
+        title_lower = title.lower()
+
+        title_matches = len(query_ctx.query_words & set(_WORD_RE.findall(title_lower)))
+        return (
+            self._compute_keyword_score(
+                query_ctx, text, title, payload.get("source", "")
+            ),
+            title_matches,
+            title_matches > 0 and query_ctx.title_query in title_lower,
+            bool(section) and section.lower() in _REFERENCE_SECTIONS,
+            text.count("[["),
+            len(text),
+            any(m in text_lower for m in _CONTENT_MARKERS),
+            self._has_word_hit(text_lower, query_ctx.query_words),
         )
 
+    @staticmethod
+    def _build_result(result, bm25_score, keyword_score, hybrid_score, final_score):
+        payload = result.payload
         return {
             "id": result.id,
-            "text": text,
+            "text": payload.get("text", ""),
             "title": payload.get("title", ""),
             "source": payload.get("source", ""),
-            "section": section,
+            "section": payload.get("section", ""),
             "chunk_index": payload.get("chunk_index", 0),
-            "vector_score": vector_score,
+            "vector_score": result.score,
             "bm25_score": bm25_score,
             "keyword_score": keyword_score,
             "hybrid_score": hybrid_score,
             "final_score": final_score,
         }
 
-    def _apply_scoring_rules(
-            self, hybrid_score, keyword_score, query_words, title, section, text, query
-    ):
-        final_score = 0.5 * hybrid_score + 0.5 * keyword_score
-
-        title_words = set(re.findall(r"\b\w+\b", title))
-        title_matches = len(query_words & title_words)
-        if title_matches > 0:
-            if query.lower().replace(" ", "_") in title:
-                final_score *= 2.0
-            else:
-                final_score *= 1.0 + title_matches * 1.5
-
-        if section.lower() in [
-            "см. также",
-            "см также",
-            "источники информации",
-            "источники",
-            "литература",
-        ]:
-            final_score *= 0.5
-
-        link_count = text.count("[[")
-        text_length = len(text)
-        if text_length > 0 and link_count > 3:
-            if (link_count * 50) / text_length > 0.3:
-                final_score *= 0.8
+    @staticmethod
+    def _apply_scoring_rules(hybrid_scores: np.ndarray, features: np.ndarray):
+        (
+            keyword_scores,
+            title_matches,
+            title_exact,
+            reference_section,
+            link_count,
+            text_length,
+            has_marker,
+            has_word_hit,
+        ) = features.T
+
+        final_scores = 0.5 * hybrid_scores + 0.5 * keyword_scores
+        final_scores *= np.where(
+            title_matches > 0,
+            np.where(title_exact > 0, 2.0, 1.0 + title_matches * 1.5),
+            1.0,
+        )
+        final_scores *= np.where(reference_section > 0, 0.5, 1.0)
 
-        text_lower = text.lower()
-        markers = [
-            "определение", "теорема", "лемма",
-            "доказательство", "утверждение", "алгоритм",
-        ]
-        if any(m in text_lower for m in markers):
-            final_score *= 1.1
+        link_ratio = np.divide(
+            link_count * 50,
+            text_length,
+            out=np.zeros_like(text_length),
+            where=text_length > 0,
+        )
+        link_heavy = (text_length > 0) & (link_count > 3) & (link_ratio > 0.3)
+        final_scores *= np.where(link_heavy, 0.8, 1.0)
+        final_scores *= np.where(has_marker > 0, 1.1, 1.0)
+        final_scores *= np.where(has_word_hit > 0, 1.0, 0.2)
 
-        return final_score
+        return final_scores
 
     def _normalize_text(self, text: str) -> str:
         return text.replace("_", " ").lower()
 
     def _extract_ngrams(self, text: str, n: int) -> set:
-        normalized = self._normalize_text(text)
-        words = re.findall(r"\b\w+\b", normalized)
-        if len(words) < n:
-            return set()
-        return set(" ".join(words[i: i + n]) for i in range(len(words) - n + 1))
+        return self._ngrams(_WORD_RE.findall(self._normalize_text(text)), n)
+
+    @staticmethod
+    def _ngrams(words: List[str], n: int) -> Set[str]:
+        return set(map(" ".join, zip(*(islice(words, i, None) for i in range(n)))))
 
     def _clean_query(self, query_lower: str) -> str:
-        return re.sub(
-            r"^(что такое|как|где|когда|почему|какой|какая|какие)\s+", "", query_lower
-        ).strip()
+        return _QUESTION_PREFIX_RE.sub("", query_lower).strip()
 
     def _exact_substring_score(
         self, clean_query: str, text_lower: str, title_lower: str, source_lower: str
     ) -> float:
         score = 0.0
-        if clean_query and clean_query in text_lower:
+        if not clean_query:
+            return score
+        if clean_query in text_lower:
             score += 0.7
-        if clean_query and clean_query in title_lower:
+        if clean_query in title_lower:
             score += 0.5
-        if clean_query and clean_query in source_lower:
+        if clean_query in source_lower:
             score += 0.8
         return score
 
+    @staticmethod
+    def _add_overlap_score(
+        score: float, query_items: Set[str], weighted_fields
+    ) -> float:
+        for field_items, weight in weighted_fields:
+            matches = len(query_items & field_items)
+            if matches > 0:
+                score += weight * (matches / len(query_items))
+        return score
+
     def _ngram_match_score(
         self,
-        query_for_ngrams: str,
-        text_lower: str,
-        title_lower: str,
-        source_lower: str,
+        query_ctx: QueryContext,
+        text_words: List[str],
+        title_words: List[str],
+        source_words: List[str],
     ) -> float:
         score = 0.0
-        query_bigrams = self._extract_ngrams(query_for_ngrams, 2)
-        query_trigrams = self._extract_ngrams(query_for_ngrams, 3)
-        text_bigrams = self._extract_ngrams(text_lower, 2)
-        text_trigrams = self._extract_ngrams(text_lower, 3)
-        title_bigrams = self._extract_ngrams(title_lower, 2)
-        title_trigrams = self._extract_ngrams(title_lower, 3)
-        source_bigrams = self._extract_ngrams(source_lower, 2)
-        source_trigrams = self._extract_ngrams(source_lower, 3)
+        query_bigrams = query_ctx.bigrams
+        query_trigrams = query_ctx.trigrams
 
         if query_trigrams:
-            trigram_text_matches = len(query_trigrams & text_trigrams)
-            trigram_title_matches = len(query_trigrams & title_trigrams)
-            trigram_source_matches = len(query_trigrams & source_trigrams)
-
-            if trigram_text_matches > 0:
-                score += 0.5 * (trigram_text_matches / len(query_trigrams))
-            if trigram_title_matches > 0:
-                score += 0.4 * (trigram_title_matches / len(query_trigrams))
-            if trigram_source_matches > 0:
-                score += 0.6 * (trigram_source_matches / len(query_trigrams))
+            score = self._add_overlap_score(score, query_trigrams, (
+                (self._ngrams(text_words, 3), 0.5),
+                (self._ngrams(title_words, 3), 0.4),
+                (self._ngrams(source_words, 3), 0.6),
+            ))
 
         if query_bigrams:
-            bigram_text_matches = len(query_bigrams & text_bigrams)
-            bigram_title_matches = len(query_bigrams & title_bigrams)
-            bigram_source_matches = len(query_bigrams & source_bigrams)
-
-            if bigram_text_matches > 0:
-                score += 0.3 * (bigram_text_matches / len(query_bigrams))
-            if bigram_title_matches > 0:
-                score += 0.25 * (bigram_title_matches / len(query_bigrams))
-            if bigram_source_matches > 0:
-                score += 0.4 * (bigram_source_matches / len(query_bigrams))
+            score = self._add_overlap_score(score, query_bigrams, (
+                (self._ngrams(text_words, 2), 0.3),
+                (self._ngrams(title_words, 2), 0.25),
+                (self._ngrams(source_words, 2), 0.4),
+            ))
 
         return score
 
     def _filter_query_words(self, query_lower: str) -> Set[str]:
-        stopwords = {
-            "что",
-            "такое",
-            "это",
-            "как",
-            "где",
-            "когда",
-            "почему",
-            "какой",
-            "какая",
-            "какие",
-            "является",
+        return {
+            word
+            for word in _WORD_RE.findall(query_lower)
+            if word not in _QUERY_STOPWORDS and len(word) > 1
         }
-        words = set()
-        for word in re.findall(r"\b\w+\b", query_lower):
-            if word not in stopwords and len(word) > 1:
-                words.add(word)
-        return words
 
     def _word_match_score(
         self,
         query_words: Set[str],
-        text_lower: str,
-        title_lower: str,
-        source_lower: str,
+        text_words: List[str],
+        title_words: List[str],
+        source_words: List[str],
     ) -> float:
         if not query_words:
             return 0.0
-        text_words = set(re.findall(r"\b\w+\b", text_lower))
-        title_words = set(re.findall(r"\b\w+\b", title_lower))
-        source_words = set(re.findall(r"\b\w+\b", source_lower))
-
-        score = 0.0
-        title_matches = len(query_words & title_words)
-        if title_matches > 0:
-            score += 0.2 * (title_matches / len(query_words))
-
-        text_matches = len(query_words & text_words)
-        if text_matches > 0:
-            score += 0.15 * (text_matches / len(query_words))
-
-        source_matches = len(query_words & source_words)
-        if source_matches > 0:
-            score += 0.25 * (source_matches / len(query_words))
-
-        return score
-
-    def _compute_keyword_score(self, query: str, payload: Dict) -> float:
-        query_lower = self._normalize_text(query)
-        text_lower = self._normalize_text(payload.get("text", ""))
-        title_lower = self._normalize_text(payload.get("title", ""))
-        source_lower = self._normalize_text(payload.get("source", ""))
+        return self._add_overlap_score(0.0, query_words, (
+            (set(title_words), 0.2),
+            (set(text_words), 0.15),
+            (set(source_words), 0.25),
+        ))
+
+    def _compute_keyword_score(
+        self, query_ctx: QueryContext, text: str, title: str, source: str
+    ) -> float:
+        text_lower = self._normalize_text(text)
+        title_lower = self._normalize_text(title)
+        source_lower = self._normalize_text(source)
 
         score = 0.0
-        clean_query = self._clean_query(query_lower)
         score += self._exact_substring_score(
-            clean_query, text_lower, title_lower, source_lower
+            query_ctx.clean_query, text_lower, title_lower, source_lower
         )
-        query_for_ngrams = clean_query if clean_query else query_lower
+        if not (query_ctx.bigrams or query_ctx.keyword_words):
+            return min(score, 1.0)
+
+        text_words = _WORD_RE.findall(text_lower)
+        title_words = _WORD_RE.findall(title_lower)
+        source_words = _WORD_RE.findall(source_lower)
+
         score += self._ngram_match_score(
-            query_for_ngrams, text_lower, title_lower, source_lower
+            query_ctx, text_words, title_words, source_words
         )
-        query_words = self._filter_query_words(query_lower)
+        query_words = query_ctx.keyword_words
         if not query_words:
             return min(score, 1.0)
         score += self._word_match_score(
-            query_words, text_lower, title_lower, source_lower
+            query_words, text_words, title_words, source_words
         )
         return min(score, 1.0)
 
@@ -417,6 +583,11 @@ def main():
         default=0.3,
         help="Вес вектор-поиска в гибридном поиске (0.5 = равный вес вектора и BM25)",
     )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Точный перебор векторов без HNSW и квантизации",
+    )
 
     args = parser.parse_args()
 
@@ -428,6 +599,7 @@ def main():
         embedding_model=args.model,
         bm25_index_path=args.bm25_index,
         alpha=args.alpha,
+        exact_search=args.exact,
     )
 
     logger.info(f"\nПоиск: '{args.query}'")
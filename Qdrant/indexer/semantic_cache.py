@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        max_size: int = 1024,
+        threshold: float = 0.95,
+        ttl: float = 300.0,
+    ):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Dict]] = [None] * max(max_size, 0)
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, vector, key: Hashable) -> Optional[List[Dict]]:
+        if self.max_size <= 0:
+            return None
+
+        query = self._normalize(vector)
+        now = time.monotonic()
+
+        with self._lock:
+            if not self._size:
+                return None
+            similarities = self._vectors[: self._size] @ query
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            for idx in candidates[np.argsort(-similarities[candidates])]:
+                entry = self._entries[idx]
+                if entry["key"] == key and now - entry["ts"] <= self.ttl:
+                    return entry["results"]
+        return None
+
+    def put(self, vector, key: Hashable, results: List[Dict]):
+        if self.max_size <= 0:
+            return
+
+        query = self._normalize(vector)
+
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros(
+                    (self.max_size, query.shape[0]), dtype=np.float32
+                )
+            slot = self._next
+            self._vectors[slot] = query
+            self._entries[slot] = {
+                "key": key,
+                "results": results,
+                "ts": time.monotonic(),
+            }
+            self._next = (slot + 1) % self.max_size
+            self._size = min(self._size + 1, self.max_size)
+
+    def clear(self):
+        with self._lock:
+            self._entries = [None] * max(self.max_size, 0)
+            self._size = 0
+            self._next = 0
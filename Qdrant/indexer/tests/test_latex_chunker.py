@@ -0,0 +1,54 @@
+import gzip
+import shutil
+import tempfile
+
+import pytest
+import latex_chunker
+
+
+class TestLaTeXChunker:
+    @pytest.fixture
+    def cache_dir(self):
+        """Creates a temporary directory for the conversion cache"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        shutil.rmtree(temp_dir)
+
+    @pytest.fixture
+    def chunker(self, cache_dir):
+        """Create an instance of LaTeXChunker with a cache directory"""
+        return latex_chunker.LaTeXChunker(cache_dir=cache_dir)
+
+    def test_convert_latex_writes_cache(self, chunker):
+        """Test for conversion stores the plain text in the cache"""
+        raw = r"\textbf{Граф} $G = (V, E)$"
+
+        plain_text = chunker._convert_latex(raw)
+
+        assert plain_text == chunker.converter.latex_to_text(raw)
+        cached = gzip.decompress(chunker._cache_path(raw).read_bytes())
+        assert cached.decode("utf-8") == plain_text
+
+    @pytest.mark.parametrize("garbage", [
+        b"not gzip at all",
+        gzip.compress("текст".encode("utf-8"))[:10] + b"\xff" * 16,
+    ])
+    def test_corrupt_cache_is_reconverted(self, chunker, garbage):
+        """Test for a corrupt cache entry falls back to conversion and is repaired"""
+        raw = r"\emph{Дерево} -- связный граф без циклов"
+        cache_path = chunker._cache_path(raw)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_bytes(garbage)
+
+        plain_text = chunker._convert_latex(raw)
+
+        assert plain_text == chunker.converter.latex_to_text(raw)
+        cached = gzip.decompress(cache_path.read_bytes())
+        assert cached.decode("utf-8") == plain_text
+
+    def test_plain_text_skips_cache(self, chunker):
+        """Test for text without LaTeX syntax is returned as is"""
+        raw = "Обычный текст без разметки"
+
+        assert chunker._convert_latex(raw) == raw
+        assert not chunker._cache_path(raw).exists()
@@ -10,10 +10,14 @@ from query_classifier import QueryClassifier
 from config import config
 from grpc_reflection.v1alpha import reflection
 from exceptions import LLMTimeoutError
-from re import sub
+from re import compile as compile_regex
 
 logger = get_logger(__name__)
 
+KNOWLEDGE_PREFIX_RE = compile_regex(
+    r'^Просмотр_исходного_текста_страницы_[^\r\n]*\.tex\s*\|\s*'
+)
+
 
 class llmServiceServicer(llm_service_pb2_grpc.llmServiceServicer):
     """
@@ -63,10 +67,9 @@ class llmServiceServicer(llm_service_pb2_grpc.llmServiceServicer):
             )
 
             template_type = self.query_classifier.classify(request.question)
-            context_text = ''
-            for ctx in request.contexts:
-                ctx = clean_knowledge_chunk(ctx)
-                context_text += ctx + '\n'
+            context_text = ''.join(
+                clean_knowledge_chunk(ctx) + '\n' for ctx in request.contexts
+            )
 
             self.logger.debug(
                 f'Template type: {template_type}'
@@ -190,6 +193,12 @@ async def serve_grpc(host: str = 'localhost', port: int = 8084):
         await llm_client.initialize()
         logger.debug('LLM client initialized successfully')
 
+        try:
+            await llm_client.health_check()
+            logger.debug('LLM client warmed up: llama.cpp is reachable')
+        except Exception as e:
+            logger.warning(f'LLM client warm-up failed, continuing: {e}')
+
         server = grpc.aio.server(
             futures.ThreadPoolExecutor(max_workers=10),
         )
@@ -216,5 +225,4 @@ async def serve_grpc(host: str = 'localhost', port: int = 8084):
 
 
 def clean_knowledge_chunk(text: str) -> str:
-    return sub(r'^Просмотр_исходного_текста_страницы_[^\r\n]*\.tex\s*\|\s*',
-               '', text, count=1).lstrip()
+    return KNOWLEDGE_PREFIX_RE.sub('', text, count=1).lstrip()
@@ -1,10 +1,15 @@
 import aiohttp
 import asyncio
+import orjson
 from typing import Optional
 from exceptions import LLMClientError, LLMTimeoutError, LLMUnavailableError
 from logger import get_logger
 from config import config
-from re import search
+from re import compile as compile_regex
+
+SENTENCE_END_RE = compile_regex(r'[.!?…)"\u201d\u201c\u2019]\s*$')
+LAST_SENTENCE_RE = compile_regex(r'(.*[.!?…][)"\u201d\u201c\u2019]?)\s+')
+LAST_SENTENCE_FALLBACK_RE = compile_regex(r'(.*[.!?…][)"\u201d\u201c\u2019}]?)')
 
 
 def cut_incomplete_sentence_smart(text: str) -> str:
@@ -12,14 +17,14 @@ def cut_incomplete_sentence_smart(text: str) -> str:
     if not text:
         return text
 
-    if search(r'[.!?…)"\u201d\u201c\u2019]\s*$', text):
+    if SENTENCE_END_RE.search(text):
         return text
 
-    match = search(r'(.*[.!?…][)"\u201d\u201c\u2019]?)\s+', text)
+    match = LAST_SENTENCE_RE.search(text)
     if match:
         return match.group(1)
 
-    match2 = search(r'(.*[.!?…][)"\u201d\u201c\u2019}]?)', text)
+    match2 = LAST_SENTENCE_FALLBACK_RE.search(text)
     if match2:
         return match2.group(1)
 
@@ -164,7 +169,11 @@ class LLMClient:
 
         try:
             async with self.semaphore:
-                async with self.session.post(url, json=data) as response:
+                async with self.session.post(
+                        url,
+                        data=orjson.dumps(data),
+                        headers={'Content-Type': 'application/json'},
+                ) as response:
                     if response.status == 200:
                         result = await response.json()
                         return cut_incomplete_sentence_smart(
@@ -206,38 +215,42 @@ class LLMClient:
         """
         Performs a health check of the Llama CPP server.
 
-        Sends a GET request to http://llama_cpp:11343/health and checks if the
-        response status is 200. If not, raises an exception.
-        Creates a separate session specifically for the health check.
+        Sends a GET request to /health of every configured llama.cpp URL,
+        since generate() round-robins across all of them, and checks that
+        each response status is 200. If not, raises an exception.
+        Reuses the client session if it is initialized, otherwise creates
+        a temporary one.
 
         Raises:
             LLMTimeoutError: If the request times out.
             LLMUnavailableError: If the server is unavailable or returns non-200 status.
             LLMClientError: For other unknown errors.
         """
-        health_url = "http://llama_cpp:11343/health"
+        health_url = f'{self.llama_urls[0]}/health'
 
         timeout = aiohttp.ClientTimeout(total=10.0)
-        session = None
+        session = self.session
+        owns_session = session is None
 
         try:
-            session = aiohttp.ClientSession(timeout=timeout)
-
-            response = await session.get(health_url)
-
-            if response.status == 200:
-                self.logger.debug('Health check passed: server is healthy')
-                response.close()
-                return
-            else:
-                error_description = await response.text()
-                response.close()
-                self.logger.error(f'Health check failed: {error_description}, '
-                                  f'error code: {response.status}')
-                raise LLMUnavailableError(
-                    url=health_url,
-                    error_description=f'HTTP {response.status}: {error_description}',
-                )
+            if owns_session:
+                session = aiohttp.ClientSession(timeout=timeout)
+
+            for url in self.llama_urls:
+                health_url = f'{url}/health'
+                async with session.get(health_url, timeout=timeout) as response:
+                    if response.status != 200:
+                        error_description = await response.text()
+                        self.logger.error(f'Health check failed: {error_description}, '
+                                          f'error code: {response.status}')
+                        raise LLMUnavailableError(
+                            url=health_url,
+                            error_description=(
+                                f'HTTP {response.status}: {error_description}'
+                            ),
+                        )
+
+            self.logger.debug('Health check passed: server is healthy')
 
         except asyncio.TimeoutError:
             self.logger.warning(f'Health check timeout: {timeout.total}')
@@ -249,5 +262,5 @@ class LLMClient:
             self.logger.error(f'Health check unknown error: {e}')
             raise LLMClientError(f'Unknown error during health check: {str(e)}')
         finally:
-            if session and not session.closed:
+            if owns_session and session and not session.closed:
                 await session.close()
@@ -38,7 +38,7 @@ class PromptEngine:
                 self.logger.critical('PromptEngine: no template files found')
                 raise Exception('No template files found in directory')
 
-            for template_file in self.prompts_dir.rglob('*.txt'):
+            for template_file in template_files:
                 template_name = template_file.stem
                 with open(template_file, 'r', encoding='utf8') as f:
                     self.templates[template_name] = f.read().strip()
@@ -3,6 +3,27 @@ from logger import get_logger
 from patterns import Pattern
 
 
+def _combine_patterns(patterns):
+    """
+    Combines a list of patterns into one compiled alternation.
+
+    A leading global (?i) flag is turned into a scoped (?i:...) group,
+    so it keeps applying to its own pattern only.
+    """
+    parts = []
+    for pattern in patterns:
+        if pattern.startswith('(?i)'):
+            parts.append(f'(?i:{pattern[4:]})')
+        else:
+            parts.append(f'(?:{pattern})')
+    return re.compile('|'.join(parts))
+
+
+WISETASK_RE = _combine_patterns(Pattern.wisetask_patterns)
+DEFINITION_RE = _combine_patterns(Pattern.definition_patterns)
+EXPLANATION_RE = _combine_patterns(Pattern.explanation_patterns)
+
+
 class QueryClassifier:
     """Classifier for query type detection"""
 
@@ -31,20 +52,17 @@ class QueryClassifier:
         question_lower = question.lower().strip()
         self.logger.debug(f'Classifying question: "{question}"')
 
-        for pattern in Pattern.wisetask_patterns:
-            if re.search(pattern, question_lower):
-                self.logger.debug(f'Question classified as WISE_TASK: "{question}"')
-                return 'wise_task'
+        if WISETASK_RE.search(question_lower):
+            self.logger.debug(f'Question classified as WISE_TASK: "{question}"')
+            return 'wise_task'
 
-        for pattern in Pattern.definition_patterns:
-            if re.search(pattern, question_lower):
-                self.logger.debug(f'Question classified as DEFINITION: "{question}"')
-                return 'definition'
+        if DEFINITION_RE.search(question_lower):
+            self.logger.debug(f'Question classified as DEFINITION: "{question}"')
+            return 'definition'
 
-        for pattern in Pattern.explanation_patterns:
-            if re.search(pattern, question_lower):
-                self.logger.debug(f'Question classified as EXPLANATION: "{question}"')
-                return 'explanation'
+        if EXPLANATION_RE.search(question_lower):
+            self.logger.debug(f'Question classified as EXPLANATION: "{question}"')
+            return 'explanation'
 
         self.logger.debug(f'Question classified as EXPLANATION (default): "{question}"')
         return 'explanation'
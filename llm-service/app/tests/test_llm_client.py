@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import llm_client
 
 
@@ -54,3 +54,35 @@ class TestLLMClient:
 
         assert mock_session.close.called
         assert llm_client.session is None
+
+    @pytest.mark.asyncio
+    async def test_health_check_reuses_session(self, llm_client, mock_session):
+        """Test for health check uses the initialized session"""
+        mock_response = AsyncMock()
+        mock_response.status = 200
+        mock_get_context_manager = AsyncMock()
+        mock_get_context_manager.__aenter__.return_value = mock_response
+        mock_session.get = MagicMock(return_value=mock_get_context_manager)
+
+        await llm_client.initialize()
+        await llm_client.health_check()
+
+        assert mock_session.get.call_args.args[0] == 'http://llama_cpp:11343/health'
+        assert mock_get_context_manager.__aexit__.called
+        assert not mock_session.close.called
+
+    @pytest.mark.asyncio
+    async def test_health_check_checks_every_url(self, llm_client, mock_session):
+        """Test for health check requests every configured server"""
+        llm_client.llama_urls = ['http://llama_a:11343', 'http://llama_b:11343']
+        mock_response = AsyncMock()
+        mock_response.status = 200
+        mock_get_context_manager = AsyncMock()
+        mock_get_context_manager.__aenter__.return_value = mock_response
+        mock_session.get = MagicMock(return_value=mock_get_context_manager)
+
+        await llm_client.initialize()
+        await llm_client.health_check()
+
+        requested = [call.args[0] for call in mock_session.get.call_args_list]
+        assert requested == ['http://llama_a:11343/health', 'http://llama_b:11343/health']